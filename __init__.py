@@ -2,12 +2,22 @@ import gdb
 import os
 import sys
 
+QT5_PRINTERS_PATH = os.path.expanduser("~/.config/gdb/qt_printers/qt5printers")
+QT6_PRINTERS_PATH = os.path.expanduser("~/.config/gdb/qt_printers/qt6printers")
+
+# Printer sets already registered by the setup commands
+_registered = set()
+
 class Qt5PrintersSetupCommand(gdb.Command):
     def __init__(self):
         super(Qt5PrintersSetupCommand, self).__init__("setup-qt5-printers", gdb.COMMAND_USER)
 
     def invoke(self, argument, from_tty):
-        printers_path = os.path.expanduser(f"~/.config/gdb/qt_printers/qt5printers")
+        if 'qt5' in _registered:
+            print("Qt5 printers already registered")
+            return
+
+        printers_path = QT5_PRINTERS_PATH
         
         if not os.path.exists(printers_path):
             print(f"Error: Printers directory not found at {printers_path}")
@@ -21,6 +31,7 @@ class Qt5PrintersSetupCommand(gdb.Command):
         try:
             from .qt5printers import register_qt5_printers
             register_qt5_printers(None)
+            _registered.add('qt5')
             print("Qt5 printers successfully registered")
         except Exception as e:
             print(f"Error registering Qt5 printers: {str(e)}")
@@ -30,7 +41,11 @@ class Qt6PrintersSetupCommand(gdb.Command):
         super(Qt6PrintersSetupCommand, self).__init__("setup-qt6-printers", gdb.COMMAND_USER)
 
     def invoke(self, argument, from_tty):
-        printers_path = os.path.expanduser(f"~/.config/gdb/qt_printers/qt6printers")
+        if 'qt6' in _registered:
+            print("Qt6 printers already registered")
+            return
+
+        printers_path = QT6_PRINTERS_PATH
         
         if not os.path.exists(printers_path):
             print(f"Error: Printers directory not found at {printers_path}")
@@ -44,6 +59,7 @@ class Qt6PrintersSetupCommand(gdb.Command):
         try:
             from .qt6printers import register_qt6_printers
             register_qt6_printers(None)
+            _registered.add('qt6')
             print("Qt6 printers successfully registered")
         except Exception as e:
             print(f"Error registering Qt6 printers: {str(e)}")
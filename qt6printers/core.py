@@ -1,28 +1,89 @@
+import functools
 import gdb.printing
-import itertools
-import sys
+import gdb.types
+import os
+import re
+import struct
 from enum import Enum
-from datetime import datetime
+from datetime import datetime, timedelta
 
 """Qt6Core pretty printer for GDB."""
 
-PY2 = sys.version_info[0] == 2
-PY3 = sys.version_info[0] == 3
-
-if PY3:
-    from helper_py3 import Iterator
-    from helper_py3 import unichr
-else:
-    from helper_py2 import Iterator
-    from helper_py2 import unichr
+# Set QT6PRINTERS_BYTEARRAY_CHILDREN=1 to also list the bytes of a QByteArray as children.
+# Off by default: GDB/MI enumerates the children of 'string' printers too, one per byte.
+_BYTEARRAY_CHILDREN = os.environ.get('QT6PRINTERS_BYTEARRAY_CHILDREN') == '1'
+
+# One character strings for the ASCII range, shared by every QChar printed
+_ASCII = [chr(i) for i in range(128)]
+
+# Origin of QDateTime's msecs
+_EPOCH = datetime(1970, 1, 1)
+
+# Child labels of the first elements of a container, built once instead of per element
+_IDX_LABELS_COUNT = 1024
+_IDX_LABELS = tuple(f'[{i}]' for i in range(_IDX_LABELS_COUNT))
+
+def _idx_label(index):
+    """Return the child label '[index]' of a container element"""
+    return _IDX_LABELS[index] if index < _IDX_LABELS_COUNT else f'[{index}]'
+
+@functools.lru_cache(maxsize=256)
+def _lookup_type(name):
+    """Same as gdb.lookup_type(@p name), cached by name; failed lookups are not cached"""
+    return gdb.lookup_type(name)
+
+@functools.lru_cache(maxsize=256)
+def _ptr_type_by_name(name):
+    """Return the (cached) pointer gdb.Type to the type named @p name"""
+    return _lookup_type(name).pointer()
+
+@functools.lru_cache(maxsize=None)
+def _target_byteorder():
+    """Return the byte order of the inferior, 'little' or 'big', as accepted by int.from_bytes()"""
+    # let gdb rebuild an int from bytes, instead of parsing the (translated) output of 'show endian'
+    intType = _lookup_type('int')
+    probe = gdb.Value(b'\x01' + b'\x00' * (intType.sizeof - 1), intType)
+    return 'little' if int(probe) == 1 else 'big'
+
+def _utf16_codec():
+    """Return the Python codec of the UTF-16 text of the inferior"""
+    return 'utf-16-be' if _target_byteorder() == 'big' else 'utf-16-le'
+
+# Names of the fields reachable from a named struct type, keyed by the name of the type
+_FIELD_NAMES = {}
+
+def _field_names(_type):
+    """Return the set of field names of @p _type (gdb.Type), its base classes and its anonymous members"""
+    _type = _type.strip_typedefs()
+    if _type.code in (gdb.TYPE_CODE_PTR, gdb.TYPE_CODE_REF):
+        _type = _type.target().strip_typedefs()
+    if _type.tag is None and _type.name is None:
+        # anonymous struct or union: str() is "struct {...}" for all of them, don't cache
+        return _collect_field_names(_type)
+    typeName = str(_type)
+    names = _FIELD_NAMES.get(typeName)
+    if names is None:
+        names = _FIELD_NAMES[typeName] = _collect_field_names(_type)
+    return names
+
+def _collect_field_names(_type):
+    """Uncached part of _field_names(), @p _type has its typedefs stripped"""
+    names = set()
+    if _type.code in (gdb.TYPE_CODE_STRUCT, gdb.TYPE_CODE_UNION):
+        for field in _type.fields():
+            if field.name:
+                names.add(field.name)
+            if field.is_base_class or not field.name:
+                names |= _field_names(field.type)
+    return frozenset(names)
+
+def type_has_field(_type, name):
+    """Check whether @p _type (gdb.Type), a base class or an anonymous member of it has a field named @p name"""
+    return name in _field_names(_type)
 
 def has_field(val, name):
     """Check whether @p val (gdb.Value) has a field named @p name"""
-    try:
-        val[name]
-        return True
-    except Exception:
-        return False
+    return type_has_field(val.type, name)
 
 class QByteArrayPrinter:
     """Print a Qt6 QByteArray"""
@@ -31,10 +92,33 @@ class QByteArrayPrinter:
         self.val = _val
         self.d_ptr = self.val['d']
         self.size = int(self.d_ptr['size'])
+        self._buf = None
+
+    def _rawData(self):
+        """Read the whole byte array from the inferior with a single memory read"""
+        if self._buf is None:
+            if self.size == 0:
+                self._buf = b''
+            else:
+                self._buf = gdb.selected_inferior().read_memory(int(self.d_ptr['ptr']), self.size).tobytes()
+        return self._buf
+
+    def to_string(self):
+        raw = self._rawData()
+        try:
+            return raw.decode('utf-8')
+        except UnicodeDecodeError:
+            return raw.decode('latin1')
+
+    def display_hint(self):
+        return 'string'
 
-    class QByteArrayIterator(Iterator):
-        def __init__(self, _data, _size : int):
-            self.data = _data
+class QByteArrayChildrenPrinter(QByteArrayPrinter):
+    """Print a Qt6 QByteArray and its bytes as children, see _BYTEARRAY_CHILDREN"""
+
+    class QByteArrayIterator:
+        def __init__(self, _buf, _size : int):
+            self.buf = _buf
             self.size = _size
             self.index = 0
 
@@ -46,27 +130,16 @@ class QByteArrayPrinter:
                 raise StopIteration
             index = self.index
             self.index = self.index + 1
-            return ((f'[{index}]'), self.data[index])
-
-    def _stringData(self):
-        return self.d_ptr['ptr'].cast(gdb.lookup_type('char').pointer())
+            return (_idx_label(index), self.buf[index])
 
     def children(self):
-        return self.QByteArrayIterator(self._stringData(), self.size)
+        if self.size == 0:
+            return []
+        return self.QByteArrayIterator(self._rawData(), self.size)
 
     def num_children(self):
         return self.size
 
-    def to_string(self):
-        data = self._stringData()
-        try:
-            return data.string(length = self.size)
-        except:
-            return data.string(length = self.size, encoding = 'latin1')
-
-    def display_hint(self):
-        return 'string'
-
 class QCharPrinter:
     """Print a Qt6 QChar"""
 
@@ -74,342 +147,329 @@ class QCharPrinter:
         self.val = _val
 
     def to_string(self):
-        return unichr(int(self.val['ucs']))
+        ucs = int(self.val['ucs'])
+        return _ASCII[ucs] if ucs < 128 else chr(ucs)
 
     def display_hint(self):
         return 'string'
 
-class QLatin1StringPrinter:
-    """Print a Qt6 QLatin1String"""
+class _StringViewPrinter:
+    """Base printer for the Qt6 string views, a m_data pointer and a m_size length in characters"""
+    bytes_per_char = 1
+    encoding = 'latin1'
 
     def __init__(self, _val : gdb.Value):
         self.val = _val
-        self.bytes_per_char = 1
-        self.encoding = 'latin1'
 
     def to_string(self):
-        result = ''
+        size = int(self.val['m_size'])
+        if size <= 0:
+            return ''
         try:
-            size = int(self.val['m_size'])
-            if size == 0:
-                return result
-            data = self.val['m_data'].cast(gdb.lookup_type('char').pointer())
-            size = size * self.bytes_per_char
-            result = data.string(encoding = self.encoding, length = size)
-        except Exception:
-            pass
-        return result
+            raw = gdb.selected_inferior().read_memory(int(self.val['m_data']), size * self.bytes_per_char)
+        except gdb.MemoryError:
+            return '<unreadable>'
+        return bytes(raw).decode(self.encoding, errors = 'replace')
 
     def display_hint(self):
         return 'string'
 
-class QStringViewPrinter:
-    """Print a Qt6 QStringView"""
-
-    def __init__(self, _val):
-        self.val = _val
-        self.bytes_per_char = 2
-        self.encoding = 'utf-16'
+class QLatin1StringPrinter(_StringViewPrinter):
+    """Print a Qt6 QLatin1String"""
+    bytes_per_char = 1
+    encoding = 'latin1'
 
-    def to_string(self):
-        result = ''
-        try:
-            size = int(self.val['m_size'])
-            if size == 0:
-                return result
-            data = self.val['m_data'].cast(gdb.lookup_type('char').pointer())
-            size = size * self.bytes_per_char
-            result = data.string(encoding = self.encoding, length = size)
-        except Exception:
-            pass
-        return result
+class QStringViewPrinter(_StringViewPrinter):
+    """Print a Qt6 QStringView"""
+    bytes_per_char = 2
 
-    def display_hint(self):
-        return 'string'
+    @property
+    def encoding(self):
+        return _utf16_codec()
 
 class QStringPrinter:
     """Print a Qt6 QString"""
 
     def __init__(self, _val : gdb.Value):
         self.val = _val
+        self.d_ptr = self.val['d']
+        self.size = int(self.d_ptr['size'])
 
     def to_string(self):
-        result = ''
+        if self.size <= 0:
+            return ''
         try:
-            d_ptr = self.val['d']
-            size = int(self.val['d']['size'])
-            if size == 0:
-                return result
-            data = d_ptr['ptr'].cast(gdb.lookup_type('char').pointer())
-            result = data.string(encoding = 'utf-16', length = size * 2)
-        except Exception:
-            pass
-        return result
-
-    def num_children(self):
-        return self.val['d']['size']
+            raw = gdb.selected_inferior().read_memory(int(self.d_ptr['ptr']), self.size * 2)
+        except gdb.MemoryError:
+            return '<unreadable>'
+        return bytes(raw).decode(_utf16_codec(), errors = 'replace')
 
     def display_hint(self):
         return 'string'
 
-class QUtf8StringViewPrinter:
+class QUtf8StringViewPrinter(_StringViewPrinter):
     """Print a Qt6 QUtf8StringView"""
-
-    def __init__(self, _val : gdb.Value):
-        self.val = _val
-        self.bytes_per_char = 1
-        self.encoding = 'utf-8'
-
-    def to_string(self):
-        result = ''
-        try:
-            d_ptr = self.val['d']
-            size = int(self.val['d']['size'])
-            if size == 0:
-                return result
-            data = d_ptr['ptr'].cast(gdb.lookup_type('char').pointer())
-            result = data.string(encoding = 'utf-16', length = size * 2)
-        except Exception:
-            pass
-        return result
-
-    def display_hint(self):
-        return 'string'
+    bytes_per_char = 1
+    encoding = 'utf-8'
 
 class QListPrinter:
     """Print a Qt6 QList"""
+
+    # Name shown by to_string(), overridden by the QList based containers
+    _container_name = 'QList'
+    _show_template_arg = True
+
     def __init__(self, _val : gdb.Value):
         self.val = _val
         self.d_ptr = self.val['d']
         self.size = int(self.d_ptr['size'])
         self.template_type = self.val.type.template_argument(0)
-
-    class QListIterator(Iterator):
-        def __init__(self, _nodetype : gdb.Type, _d_ptr : gdb.Value):
-            self.nodetype = _nodetype
-            self.d_ptr = _d_ptr
+        self._type_str = self._container_name
+        if self._show_template_arg:
+            self._type_str = f'{self._type_str}<{self.template_type}>'
+        self._nodeptr_type = self.template_type.pointer()
+
+    class QListIterator:
+        def __init__(self, _nodeptr_type : gdb.Type, _d_ptr : gdb.Value, _size : int):
+            self.nodeptr_type = _nodeptr_type
+            self.base_addr = int(_d_ptr['ptr'])
+            self.stride = _nodeptr_type.target().sizeof
+            self.size = _size
             self.index = 0
 
         def __iter__(self):
             return self
 
         def __next__(self):
-            size = int(self.d_ptr['size'])
-
-            if self.index >= size:
+            if self.index >= self.size:
                 raise StopIteration
             index = self.index
-            value = self.d_ptr['ptr'] + index
+            addr = self.base_addr + index * self.stride
             self.index = self.index + 1
-            return ((f'[{index}]'), value.cast(self.nodetype.pointer()).dereference())
+            return (_idx_label(index), gdb.Value(addr).cast(self.nodeptr_type).dereference())
 
     def children(self):
-        return self.QListIterator(self.template_type, self.d_ptr)
+        if self.size == 0:
+            return []
+        return self.QListIterator(self._nodeptr_type, self.d_ptr, self.size)
 
     def num_children(self):
         return self.size
 
     def to_string(self):
         if self.size == 0:
-            return f'QList<{self.template_type}> is empty'
-        return f'QList<{self.template_type}> with size = {self.size}'
+            return f'{self._type_str} is empty'
+        return f'{self._type_str} with size = {self.size}'
 
 class QStringListPrinter(QListPrinter):
     """Print a Qt6 QStringList"""
-    def __init__(self, _val : gdb.Value):
-        super().__init__(_val)
-
-    def to_string(self):
-        if self.size == 0:
-            return 'QStringList is empty'
-        return f'QStringList with size = {self.size}'
+    _container_name = 'QStringList'
+    _show_template_arg = False
 
 class QQueuePrinter(QListPrinter):
     """Print a Qt6 QQueue"""
-    def __init__(self, _val : gdb.Value):
-        super().__init__(_val)
-
-    def to_string(self):
-        if self.size == 0:
-            return f'QQueue<{self.template_type}> is empty'
-        return f'QQueue<{self.template_type}> with size = {self.size}'
+    _container_name = 'QQueue'
 
 class QVectorPrinter(QListPrinter):
     """Print a Qt6 QVector"""
     """QVector is alias for QList"""
-    
-    def __init__(self, _val : gdb.Value):
-        super().__init__(_val)
-
-    def to_string(self):
-        if self.size == 0:
-            return f'QVector<{self.template_type}> is empty'
-        return f'QVector<{self.template_type}> with size = {self.size}'
+    _container_name = 'QVector'
 
 class QStackPrinter(QListPrinter):
     """Print a Qt6 QStack"""
-    
-    def __init__(self, _val : gdb.Value):
-        super().__init__(_val)
+    _container_name = 'QStack'
 
-    def to_string(self):
-        if self.size == 0:
-            return f'QStack<{self.template_type}> is empty'
-        return f'QStack<{self.template_type}> with size = {self.size}'
+def _printer_lookups():
+    """Yield the registered pretty-printer lookup functions in the order gdb.default_visualizer() tries them"""
+    for objfile in gdb.objfiles():
+        yield from objfile.pretty_printers
+    yield from gdb.current_progspace().pretty_printers
+    yield from gdb.pretty_printers
 
 class QMapPrinter:
     """Print a Qt6 QMap"""
 
+    # Name shown by to_string(), overridden by QMultiMap
+    _container_name = 'QMap'
+
+    # lookup function which found the printer of QMap::d::d::m, keyed by the name of its type
+    _stdMapLookups = {}
+
+    @classmethod
+    def _stdMapVisualizer(cls, m : gdb.Value):
+        """Same as gdb.default_visualizer(m), but only scans the registered printers once per std::map type"""
+        typeName = str(m.type)
+        lookup = cls._stdMapLookups.get(typeName)
+        if lookup is not None and getattr(lookup, 'enabled', True):
+            printer = lookup(m)
+            if printer is not None:
+                return printer
+
+        for lookup in _printer_lookups():
+            if not getattr(lookup, 'enabled', True):
+                continue
+            printer = lookup(m)
+            if printer is not None:
+                cls._stdMapLookups[typeName] = lookup
+                return printer
+        return None
+
     def __init__(self, _val : gdb.Value):
         self.val = _val
         self.qt6StdMapPrinter = None
-        if has_field(self.val['d']['d'], 'ptr'):
-            ptr = self.val['d']['d']['ptr']
-            self.qt6StdMapPrinter = gdb.default_visualizer(ptr['m'])
-        else:
-            ptr = self.val['d']['d']
-            self.qt6StdMapPrinter = gdb.default_visualizer(ptr['m'])
+        d = self.val['d']['d']
+        # whether QMap::d::d has a 'ptr' field is cached by type_has_field()
+        ptr = d['ptr'] if type_has_field(d.type, 'ptr') else d
+        self.qt6StdMapPrinter = self._stdMapVisualizer(ptr['m'])
+        self._type_str = f'{self._container_name}<{self.val.type.template_argument(0)}, {self.val.type.template_argument(1)}>'
+        # bound once, GDB calls both to_string() and children() on the same printer
+        self._children_fn = getattr(self.qt6StdMapPrinter, 'children', None)
+        num_children_fn = getattr(self.qt6StdMapPrinter, 'num_children', None)
+        nc = num_children_fn() if num_children_fn is not None else None
+        self._nc = int(nc) if nc is not None else None
 
     def children(self):
-        if self.qt6StdMapPrinter != None:
-            if hasattr(self.qt6StdMapPrinter, 'children'):
-                return self.qt6StdMapPrinter.children() # type: ignore
-            return []
-        else:
+        if self._children_fn is None or self._nc == 0:
             return []
+        return self._children_fn()
 
     def to_string(self):
-        num_children = self.num_children()
-        if num_children is None:
-            return f'QMap<{self.val.type.template_argument(0)}, {self.val.type.template_argument(1)}> with size = ?'
-        return f'QMap<{self.val.type.template_argument(0)}, {self.val.type.template_argument(1)}> with size = {int(num_children)}'
+        if self._nc is None:
+            return f'{self._type_str} with size = ?'
+        return f'{self._type_str} with size = {self._nc}'
 
     def num_children(self):
-        if self.qt6StdMapPrinter:
-            if hasattr(self.qt6StdMapPrinter, 'num_children'):
-                return self.qt6StdMapPrinter.num_children() #type: ignore
-
-        return None
+        return self._nc
 
     def display_hint(self):
         return None
 
 class QMultiMapPrinter(QMapPrinter):
     """Print a Qt6 QMultiMap"""
-
-    def __init__(self, _val : gdb.Value):
-        super().__init__(_val)
-
-    def to_string(self):
-        num_children = self.num_children()
-        if num_children is None:
-            return f'QMultiMap<{self.val.type.template_argument(0)}, {self.val.type.template_argument(1)}> with size = ?'
-        return f'QMultiMap<{self.val.type.template_argument(0)}, {self.val.type.template_argument(1)}> with size = {int(num_children)}'
+    _container_name = 'QMultiMap'
 
 class QHashPrinter:
     """Print a Qt6 QHash"""
 
+    # Name shown by to_string(), overridden by QMultiHash
+    _container_name = 'QHash'
+
     def __init__(self, _val : gdb.Value):
         self.val = _val
+        self._type_str = f'{self._container_name}<{self.val.type.template_argument(0)}, {self.val.type.template_argument(1)}>'
+        if has_field(self.val, 'm_size'):
+            self.size = int(self.val['m_size'])
+        else:
+            d = self.val['d']
+            self.size = int(d['size']) if d else 0
 
-    class QHashIterator(Iterator):
+    class QHashIterator:
         """
         Representation Invariants:
-            - self.currentNode is valid if self.d is not 0
-            - self.chain is valid if self.currentNode is valid and self.isMulti is True
+            - self.currentNodeAddr is valid if self.started is True and self.exhausted is False
+            - self.chain is valid if self.currentNodeAddr is valid and self.isMulti is True
         """
         def __init__(self, _val : gdb.Value, _isMultiMap : bool):
             self.val = _val
             self.d_ptr = self.val['d']
+            self.numBuckets = int(self.d_ptr['numBuckets'])
             self.bucket = 0
             self.count = 0
+            self.exhausted = False
             self.isMulti = _isMultiMap
+            # layout of d->spans[], to compute the node addresses without going through gdb.Value
+            spans = self.d_ptr['spans']
+            spanType = spans.type.target().strip_typedefs()
+            entryPtrType = spanType['entries'].type.strip_typedefs()
+            entryType = entryPtrType.target().strip_typedefs()
+            self.spansAddr = int(spans)
+            self.spanSize = spanType.sizeof
+            self.offsetsOffset = spanType['offsets'].bitpos // 8
+            self.entriesOffset = spanType['entries'].bitpos // 8
+            self.ptrSize = entryPtrType.sizeof
+            self.entrySize = entryType.sizeof
+            self.storageOffset = entryType['storage'].bitpos // 8
+            self.byteOrder = _target_byteorder()
+            # offsets[] and entries of the last span read, see spanOffsets()
+            self.cachedSpan = -1
+            self.cachedOffsets = b''
+            self.cachedEntries = 0
 
             keyType = self.val.type.template_argument(0)
             valueType = self.val.type.template_argument(1)
             nodeStruct = 'MultiNode' if self.isMulti else 'Node'
             self.nodeType = f'QHashPrivate::{nodeStruct}<{keyType}, {valueType}>'
+            self.nodePtrType = _ptr_type_by_name(self.nodeType)
 
-            self.firstNode()
+            # firstNode() is deferred to the first __next__(), GDB may not ask for any child
+            self.started = False
 
         def __iter__(self):
             return self
 
-        def span(self):
-            "Python port of iterator::span()"
-            return self.bucket >> 7 # SpanConstants::SpanShift
-
-        def index(self):
-            "Python port of iterator::index()"
-            return self.bucket & 127 # SpanConstants::LocalBucketMask
-
-        def isUnused (self):
-            "Python port of iterator::isUnused()"
-            # return !d->spans[span()].hasNode(index());
-            # where hasNode is return (offsets[i] != SpanConstants::UnusedEntry);
-            return self.d_ptr['spans'][self.span()]['offsets'][self.index()] == 0xff # SpanConstants::UnusedEntry
-
-        def computeCurrentNode (self):
-            "Return the node pointed by the iterator, python port of iterator::node()"
-            # return &d->spans[span()].at(index());
-            span_index = self.span()
-            span = self.d_ptr['spans'][span_index]
-            # where at() is return entries[offsets[i]].node();
-            offset = span['offsets'][self.index()]
-
-            if offset == 0xff: # UnusedEntry, can't happen
-                print("Offset points to an unused entry.")
-                return None
-
-            entry = span['entries'][int(offset)]
-
-            # where node() is return *reinterpret_cast<Node *>(&storage);
-            # where Node is QHashPrivate::(Multi|)Node<Key, T>
-            storage_pointer = entry['storage'].address
-            return storage_pointer.cast(gdb.lookup_type(self.nodeType).pointer())
-
-        def updateCurrentNode (self):
-            "Compute the current node and update the QMultiHash chain"
-            self.currentNode = self.computeCurrentNode()
-            if self.isMulti:
-                # Python port of any of the following two lines in QMultiHash::iterator:
-                # e = &it.node()->value;
-                # e = i.atEnd() ? nullptr : &i.node()->value;
-                # Note that self.currentNode must be valid (not at end) here.
-                assert(self.currentNode)
-                self.chain = self.currentNode['value']
+        def spanOffsets (self, span_index):
+            "Return the offsets[] array of a span as bytes, the span is read from the inferior once"
+            if span_index != self.cachedSpan:
+                addr = self.spansAddr + span_index * self.spanSize
+                span = gdb.selected_inferior().read_memory(addr, self.spanSize).tobytes()
+                self.cachedOffsets = span[self.offsetsOffset:self.offsetsOffset + 128] # SpanConstants::NEntries
+                self.cachedEntries = int.from_bytes(span[self.entriesOffset:self.entriesOffset + self.ptrSize], self.byteOrder)
+                self.cachedSpan = span_index
+            return self.cachedOffsets
 
         def firstNode (self):
             "Go the first node, See Data::begin()."
-            self.bucket = 0
-            if self.isUnused():
-                self.nextNode() # calls self.updateCurrentNode() if not empty
-            else:
-                self.updateCurrentNode()
+            # nextNode() starts its scan at self.bucket + 1
+            self.bucket = -1
+            self.nextNode()
 
         def nextNode (self):
             "Go to the next node, see iterator::operator++()."
-            numBuckets = self.d_ptr['numBuckets']
+            # span(), index(), isUnused() and node() are inlined here, this loop runs for every bucket
+            bucket = self.bucket
+            numBuckets = self.numBuckets
             while True:
-                self.bucket += 1
-                if self.bucket == numBuckets:
-                    self.d_ptr = gdb.Value(0)
+                bucket += 1
+                if bucket >= numBuckets:
+                    self.exhausted = True
                     self.bucket = 0
                     return
-                if not self.isUnused():
-                    self.updateCurrentNode()
+                # skip the unused entries of the span in one go
+                rest = self.spanOffsets(bucket >> 7)[bucket & 127:] # SpanConstants::SpanShift, LocalBucketMask
+                unused = len(rest) - len(rest.lstrip(b'\xff')) # SpanConstants::UnusedEntry
+                if unused == len(rest):
+                    # nothing left in this span, continue from its last bucket
+                    bucket += unused - 1
+                    continue
+                bucket += unused
+                if bucket < numBuckets:
+                    self.bucket = bucket
+                    # Python port of iterator::node(): return &d->spans[span()].at(index());
+                    # where at() is return entries[offsets[i]].node();
+                    # and node() is return *reinterpret_cast<Node *>(&storage);
+                    # self.cachedEntries is the entries pointer of the span loaded by spanOffsets()
+                    # the gdb.Value of the node is only built by the callers which need it
+                    self.currentNodeAddr = self.cachedEntries + rest[unused] * self.entrySize + self.storageOffset
+                    if self.isMulti:
+                        # Python port of any of the following two lines in QMultiHash::iterator:
+                        # e = &it.node()->value;
+                        # e = i.atEnd() ? nullptr : &i.node()->value;
+                        self.chain = gdb.Value(self.currentNodeAddr).cast(self.nodePtrType)['value']
                     return
 
         def __next__(self):
             "GDB iteration, first call returns key, second value and then jumps to the next chain or hash node."
-            if not self.d_ptr:
+            if not self.started:
+                self.started = True
+                self.firstNode()
+            if self.exhausted:
                 raise StopIteration
 
             index = self.count
             self.count = self.count + 1
             item = None
             if not self.isMulti:
-                item = self.currentNode
+                item = gdb.Value(self.currentNodeAddr).cast(self.nodePtrType)
                 self.nextNode()
             else:
                 item = self.chain
@@ -418,85 +478,73 @@ class QHashPrinter:
                     self.nextNode()
 
             assert(item)
-            result = (f'[{index}]', item.dereference())
+            result = (_idx_label(index), item.dereference())
             return result
 
     def children(self):
-        d = self.val['d']
-        if not d:
+        if self.size == 0:
             return []
         return self.QHashIterator(self.val, False)
 
     def num_children(self):
-        size = 0
-        if has_field(self.val, 'm_size'):
-            size = self.val['m_size']
-        else:
-            d = self.val['d']
-            size = d['size'] if d else 0
-        return int(size)
+        return self.size
 
     def to_string(self):
-        return f'QHash<{self.val.type.template_argument(0)}, {self.val.type.template_argument(1)}> with size = {self.num_children()}'
+        return f'{self._type_str} with size = {self.size}'
 
     def display_hint(self):
         return None
 
 class QMultiHash(QHashPrinter):
     """Print a Qt6 QMultiHash"""
-    def __init__(self, _val : gdb.Value):
-        super().__init__(_val)
+    _container_name = 'QMultiHash'
 
     def children(self):
-        d = self.val['d']
-        if not d:
+        if self.size == 0:
             return []
         return self.QHashIterator(self.val, True)
 
-    def to_string(self):
-        return f'QMultiHash<{self.val.type.template_argument(0)}, {self.val.type.template_argument(1)}> with size = {self.num_children()}'
-
 class QSetPrinter:
     """Print a Qt6 QSet"""
 
     def __init__(self, _val : gdb.Value):
         self.val = _val
+        self._type_str = f'QSet<{self.val.type.template_argument(0)}>'
+        d = self.val['q_hash']['d']
+        self.size = int(d['size']) if d else 0
 
-    class QSetIterator(Iterator):
-        def __init__(self, _hashIterator):
-            self.hash_iterator = _hashIterator
-            self.index = 0
-
-        def __iter__(self):
-            return self
+    class QSetIterator(QHashPrinter.QHashIterator):
+        """Walk the QHash<T, QHashDummyValue> of a QSet directly, yielding its keys"""
+        def __init__(self, _qhash : gdb.Value):
+            super().__init__(_qhash, False)
+            # address the key directly instead of going through node['key']
+            self.keyOffset = self.nodePtrType.target().strip_typedefs()['key'].bitpos // 8
+            self.keyPtrType = self.val.type.template_argument(0).pointer()
 
         def __next__(self):
-            if not self.hash_iterator.d_ptr:
+            if not self.started:
+                self.started = True
+                self.firstNode()
+            if self.exhausted:
                 raise StopIteration
 
-            item = self.hash_iterator.currentNode['key']
-            self.hash_iterator.nextNode()
+            item = gdb.Value(self.currentNodeAddr + self.keyOffset).cast(self.keyPtrType).dereference()
+            self.nextNode()
 
-            index = self.index
-            self.index = self.index + 1
-            return (f'[{index}]', item)
+            index = self.count
+            self.count = self.count + 1
+            return (_idx_label(index), item)
 
     def children(self):
-        qhash = self.val['q_hash']
-        d = qhash['d']
-        if not d:
+        if self.size == 0:
             return []
-
-        hashPrinter = QHashPrinter(qhash)
-        hashIterator = hashPrinter.children()
-        return self.QSetIterator(hashIterator)
+        return self.QSetIterator(self.val['q_hash'])
 
     def num_children(self):
-        d = self.val['q_hash']['d']
-        return d['size'] if d else 0
+        return self.size
 
     def to_string(self):
-        return f'QSet<{self.val.type.template_argument(0)}> with size = {self.num_children()}'
+        return f'{self._type_str} with size = {self.size}'
 
 class QVariantPrinter:
     """Print a Qt6 QVariant"""
@@ -511,7 +559,7 @@ class QVariantPrinter:
             return 'QVariant(empty)'
 
         data_type = self.d_ptr['packedType'] << 2
-        metatype_interface = data_type.cast(gdb.lookup_type('QtPrivate::QMetaTypeInterface').pointer())
+        metatype_interface = data_type.cast(_ptr_type_by_name('QtPrivate::QMetaTypeInterface'))
         type_str = ''
         try:
             typeAsCharPointer = metatype_interface['name']
@@ -529,12 +577,12 @@ class QVariantPrinter:
             value_str = f'PrivateShared({private_shared_hex})'
         else:
             if type_str.endswith('*'):
-                value_ptr = data['data'].reinterpret_cast(gdb.lookup_type('void').pointer().pointer())
+                value_ptr = data['data'].reinterpret_cast(_ptr_type_by_name('void').pointer())
                 value_str = str(value_ptr.dereference())
             else:
                 type_obj = None
                 try:
-                    type_obj = gdb.lookup_type(type_str)
+                    type_obj = _lookup_type(type_str)
                 except Exception:
                     value_str = str(data['data'])
 
@@ -544,6 +592,36 @@ class QVariantPrinter:
 
         return f'QVariant(type = "{type_str}", value = {value_str})'
 
+def _julian_to_ymd(julianDay : int):
+    """Return the (year, month, day) of the Julian day number @p julianDay, in plain Python integers"""
+    # Copied from Qt sources
+    if julianDay >= 2299161:
+        # Gregorian calendar starting from October 15, 1582
+        # This algorithm is from Henry F. Fliegel and Thomas C. Van Flandern
+        ell = julianDay + 68569
+        n = (4 * ell) // 146097
+        ell = ell - (146097 * n + 3) // 4
+        i = (4000 * (ell + 1)) // 1461001
+        ell = ell - (1461 * i) // 4 + 31
+        j = (80 * ell) // 2447
+        d = ell - (2447 * j) // 80
+        ell = j // 11
+        m = j + 2 - (12 * ell)
+        y = 100 * (n - 49) + i + ell
+    else:
+        # Julian calendar until October 4, 1582
+        # Algorithm from Frequently Asked Questions about Calendars by Claus Toendering
+        julianDay += 32082
+        dd = (4 * julianDay + 3) // 1461
+        ee = julianDay - (1461 * dd) // 4
+        mm = ((5 * ee) + 2) // 153
+        d = ee - (153 * mm + 2) // 5 + 1
+        m = mm + 3 - 12 * (mm // 10)
+        y = dd - 4800 + (mm // 10)
+        if y <= 0:
+            y = y - 1
+    return y, m, d
+
 class QDatePrinter:
     """Print a Qt6 QDate"""
 
@@ -551,38 +629,13 @@ class QDatePrinter:
         self.val = _val
 
     def to_string(self):
-        julianDay = self.val['jd']
+        # convert once, the arithmetic below then runs in Python instead of gdb
+        julianDay = int(self.val['jd'])
 
         if julianDay == 0:
             return "invalid QDate"
 
-        # Copied from Qt sources
-        if julianDay >= 2299161:
-            # Gregorian calendar starting from October 15, 1582
-            # This algorithm is from Henry F. Fliegel and Thomas C. Van Flandern
-            ell = julianDay + 68569;
-            n = (4 * ell) / 146097;
-            ell = ell - (146097 * n + 3) / 4;
-            i = (4000 * (ell + 1)) / 1461001;
-            ell = ell - (1461 * i) / 4 + 31;
-            j = (80 * ell) / 2447;
-            d = ell - (2447 * j) / 80;
-            ell = j / 11;
-            m = j + 2 - (12 * ell);
-            y = 100 * (n - 49) + i + ell;
-        else:
-            # Julian calendar until October 4, 1582
-            # Algorithm from Frequently Asked Questions about Calendars by Claus Toendering
-            julianDay += 32082;
-            dd = (4 * julianDay + 3) / 1461;
-            ee = julianDay - (1461 * dd) / 4;
-            mm = ((5 * ee) + 2) / 153;
-            d = ee - (153 * mm + 2) / 5 + 1;
-            m = mm + 3 - 12 * (mm / 10);
-            y = int(dd - 4800 + (mm / 10));
-            if y <= 0:
-                y = y - 1;
-        return "%d-%02d-%02d" % (y, m, d)
+        return "%d-%02d-%02d" % _julian_to_ymd(julianDay)
 
 class QTimePrinter:
     """Print a Qt6 QTime"""
@@ -591,7 +644,7 @@ class QTimePrinter:
         self.val = _val
 
     def to_string(self):
-        ds = self.val['mds']
+        ds = int(self.val['mds'])
 
         if ds == -1:
             return "invalid QTime"
@@ -600,9 +653,9 @@ class QTimePrinter:
         SECS_PER_MIN = 60
         MSECS_PER_MIN = 60000
 
-        hour = ds / MSECS_PER_HOUR
-        minute = (ds % MSECS_PER_HOUR) / MSECS_PER_MIN
-        second = (ds / 1000)%SECS_PER_MIN
+        hour = ds // MSECS_PER_HOUR
+        minute = (ds % MSECS_PER_HOUR) // MSECS_PER_MIN
+        second = (ds // 1000)%SECS_PER_MIN
         msec = ds % 1000
         return "%02d:%02d:%02d.%03d" % (hour, minute, second, msec)
 
@@ -630,6 +683,21 @@ def timeZoneId(spec, offsetFromUtc):
         return QTimeZonePrinter.INVALID
     return f'<error: unhandled time spec {spec}>'
 
+@functools.lru_cache(maxsize=None)
+def _string_layout(typeName):
+    """Return (sizeof(T), offset of d.ptr, offset of d.size, sizeof(d.ptr), sizeof(d.size)) from the debug info, T being QString or QByteArray"""
+    stringType = _lookup_type(typeName).strip_typedefs()
+    dField = stringType['d']
+    dType = dField.type.strip_typedefs()
+    ptrField = dType['ptr']
+    sizeField = dType['size']
+    dOffset = dField.bitpos // 8
+    return (stringType.sizeof,
+            dOffset + ptrField.bitpos // 8,
+            dOffset + sizeField.bitpos // 8,
+            ptrField.type.sizeof,
+            sizeField.type.sizeof)
+
 class QTimeZonePrinter:
     """Print a Qt6 QTimeZone"""
     INVALID = "<invalid>"
@@ -639,7 +707,7 @@ class QTimeZonePrinter:
 
     def to_string(self):
         d = self.val['d'] # QTimeZone::Data
-        isShort = d.cast(gdb.lookup_type('long long')) & 3 # QTimeZone::Data::isShort (Qt6-only)
+        isShort = d.cast(_lookup_type('long long')) & 3 # QTimeZone::Data::isShort (Qt6-only)
         if isShort:
             mode = d['s']['mode']
             spec = (mode + 3) & 3 # QTimeZone::ShortData::spec()
@@ -650,17 +718,46 @@ class QTimeZonePrinter:
             # - QSharedData (int) (plus 4 bytes of padding in case of a 64-bit architecture)
             # - vtable for QTimeZonePrivate
             # - QByteArray m_id
-            qByteArrayPointerType = gdb.lookup_type('QByteArray').pointer()
-            address = d.cast(qByteArrayPointerType.pointer()) # address of QTimeZonePrivate as QByteArray**
+            address = int(d.cast(_ptr_type_by_name('char'))) # address of QTimeZonePrivate
             if address == 0:
                 # QTimeZone::isValid(), if not short, returns d.d && d->isValid()
                 return QTimeZonePrinter.INVALID
-            address += 2 # skip the first two hidden, pointer-sized data members
-
-            tzId = QByteArrayPrinter(address.cast(qByteArrayPointerType).dereference()).to_string()
+            # skip the first two hidden, pointer-sized data members and read m_id in one go
+            ptrSize = _ptr_type_by_name('char').sizeof
+            byteArraySize, ptrOffset, sizeOffset, dataPtrSize, sizeSize = _string_layout('QByteArray')
+            inferior = gdb.selected_inferior()
+            data = inferior.read_memory(address + 2 * ptrSize, byteArraySize).tobytes()
+            byteOrder = _target_byteorder()
+            size = int.from_bytes(data[sizeOffset:sizeOffset + sizeSize], byteOrder, signed = True)
+            tzId = ''
+            if size > 0:
+                ptr = int.from_bytes(data[ptrOffset:ptrOffset + dataPtrSize], byteOrder)
+                raw = inferior.read_memory(ptr, size).tobytes()
+                try:
+                    tzId = raw.decode('utf-8')
+                except UnicodeDecodeError:
+                    tzId = raw.decode('latin1')
             # QTimeZonePrivate::isValid() returns !m_id.isEmpty()
             return tzId if tzId else QTimeZonePrinter.INVALID
 
+@functools.lru_cache(maxsize=None)
+def _qdatetime_private_layout():
+    """Return the offsets of m_status, m_msecs, m_offsetFromUtc and m_timeZone in QDateTimePrivate"""
+    try:
+        privateType = _lookup_type('QDateTimePrivate').strip_typedefs()
+        return tuple(privateType[name].bitpos // 8 for name in ('m_status', 'm_msecs', 'm_offsetFromUtc', 'm_timeZone'))
+    except (gdb.error, KeyError):
+        pass
+    # No debug info for QDateTimePrivate, which contains:
+    # - QSharedData (int)
+    # - (int) StatusFlags m_status
+    # - qint64 m_msecs
+    # - int m_offsetFromUtc (plus 4 bytes of padding in case of a 64-bit architecture)
+    # - QTimeZone m_timeZone, assuming that it is pointer-aligned
+    intSize = _lookup_type('int').sizeof
+    offsetFromUtcOffset = 2 * intSize + _lookup_type('long long').sizeof
+    return (intSize, 2 * intSize, offsetFromUtcOffset, offsetFromUtcOffset + _ptr_type_by_name('int').sizeof)
+
 def extractTimeSpec(_status):
     return (_status & QDateTimePrinter.TimeSpecMask) >> QDateTimePrinter.TimeSpecShift
 
@@ -675,7 +772,7 @@ class QDateTimePrinter:
 
     def to_string(self):
         d = self.val['d'] # QDateTime::Data
-        isShort = d.cast(gdb.lookup_type('long long')) & 1 # QDateTime::Data::isShort
+        isShort = d.cast(_lookup_type('long long')) & 1 # QDateTime::Data::isShort
         if isShort:
             msecs = d['data']['msecs']
             status = d['data']['status']
@@ -685,35 +782,26 @@ class QDateTimePrinter:
 
             timeZone = timeZoneId(spec, offsetFromUtc)
         else:
-            # QDateTimePrivate contains:
-            # - QSharedData (int)
-            # - (int) StatusFlags m_status
-            # - qint64 m_msecs
-            # - int m_offsetFromUtc (plus 4 bytes of padding in case of a 64-bit architecture)
-            # - QTimeZone m_timeZone
-            intType = gdb.lookup_type('int')
-            intPointerType = intType.pointer()
-            address = d.cast(intPointerType) # address of QDateTimePrivate as int*
-            address += 1 # skip QSharedData
-            status = address.dereference()
-            address += 1 # skip m_status
-
-            int64Type = gdb.lookup_type('long long')
-            msecs = address.cast(int64Type.pointer()).dereference()
-            address += int64Type.sizeof // intType.sizeof # skip m_msecs
-            offsetFromUtc = address.dereference()
+            statusOffset, msecsOffset, offsetFromUtcOffset, timeZoneOffset = _qdatetime_private_layout()
+            address = int(d.cast(_ptr_type_by_name('int'))) # address of QDateTimePrivate
+            size = max(statusOffset + 4, msecsOffset + 8, offsetFromUtcOffset + 4)
+            data = gdb.selected_inferior().read_memory(address, size).tobytes()
+            byteOrder = '>' if _target_byteorder() == 'big' else '<'
+            status, = struct.unpack_from(byteOrder + 'i', data, statusOffset)
+            msecs, = struct.unpack_from(byteOrder + 'q', data, msecsOffset)
+            offsetFromUtc, = struct.unpack_from(byteOrder + 'i', data, offsetFromUtcOffset)
 
             spec = extractTimeSpec(status)
 
             if spec == TimeSpec.TimeZone.value:
-                address += intPointerType.sizeof // intType.sizeof
-                # skip m_offsetFromUtc and possible padding assuming that QTimeZone is pointer-aligned
                 # print m_timeZone
-                timeZone = QTimeZonePrinter(address.cast(gdb.lookup_type('QTimeZone').pointer()).dereference()).to_string()
+                timeZone = QTimeZonePrinter(gdb.Value(address + timeZoneOffset).cast(_ptr_type_by_name('QTimeZone')).dereference()).to_string()
             else:
                 timeZone = timeZoneId(spec, offsetFromUtc)
 
-        return datetime.utcfromtimestamp(int(msecs) / 1000.0).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3] + ' ' + timeZone
+        # integer arithmetic, no float round-trip which loses the milliseconds of large timestamps
+        secs, ms = divmod(int(msecs), 1000)
+        return f'{_EPOCH + timedelta(seconds = secs):%Y-%m-%d %H:%M:%S}.{ms:03d} {timeZone}'
 
 
 class QPersistentModelIndexPrinter:
@@ -734,38 +822,36 @@ class QUrlPrinter:
 
     def to_string(self):
         try:
-            int_type = gdb.lookup_type('int')
-            string_type = gdb.lookup_type('QString')
-            string_pointer = string_type.pointer()
-
-            addr = self.val['d'].cast(gdb.lookup_type('char').pointer())
+            addr = int(self.val['d'])
             if not addr:
                 return '<invalid>'
 
-            # skip QAtomicInt ref
-            addr += int_type.sizeof
-            # handle int port
-            port = addr.cast(int_type.pointer()).dereference()
-            addr += int_type.sizeof
-            # handle QString scheme
-            scheme = QStringPrinter(addr.cast(string_pointer).dereference()).to_string()
-            addr += string_type.sizeof
-            # handle QString username
-            username = QStringPrinter(addr.cast(string_pointer).dereference()).to_string()
-            addr += string_type.sizeof
-            # skip QString password
-            addr += string_type.sizeof
-            # handle QString host
-            host = QStringPrinter(addr.cast(string_pointer).dereference()).to_string()
-            addr += string_type.sizeof
-            # handle QString path
-            path = QStringPrinter(addr.cast(string_pointer).dereference()).to_string()
-            addr += string_type.sizeof
-            # handle QString query
-            query = QStringPrinter(addr.cast(string_pointer).dereference()).to_string()
-            addr += string_type.sizeof
-            # handle QString fragment
-            fragment = QStringPrinter(addr.cast(string_pointer).dereference()).to_string()
+            # QUrlPrivate starts with QAtomicInt ref, int port and the QStrings
+            # scheme, userName, password, host, path, query and fragment:
+            # read all of them with one memory read
+            inferior = gdb.selected_inferior()
+            intSize = _lookup_type('int').sizeof
+            stringSize, ptrOffset, sizeOffset, ptrSize, sizeSize = _string_layout('QString')
+            data = inferior.read_memory(addr, 2 * intSize + 7 * stringSize).tobytes()
+            byteOrder = _target_byteorder()
+            codec = _utf16_codec()
+
+            def readString(index):
+                start = 2 * intSize + index * stringSize
+                size = int.from_bytes(data[start + sizeOffset:start + sizeOffset + sizeSize], byteOrder, signed = True)
+                if size <= 0:
+                    return ''
+                ptr = int.from_bytes(data[start + ptrOffset:start + ptrOffset + ptrSize], byteOrder)
+                return inferior.read_memory(ptr, size * 2).tobytes().decode(codec, errors = 'replace')
+
+            port = int.from_bytes(data[intSize:2 * intSize], byteOrder, signed = True)
+            scheme = readString(0)
+            username = readString(1)
+            # the password (2) is not shown
+            host = readString(3)
+            path = readString(4)
+            query = readString(5)
+            fragment = readString(6)
 
             url = ''
             if len(scheme) > 0:
@@ -796,9 +882,81 @@ class QUrlPrinter:
         return '<uninitialized>'
 
 
+def clear_caches(_event = None):
+    """Forget the types and layouts cached from the debug info, called when GDB discards the objfiles"""
+    _lookup_type.cache_clear()
+    _target_byteorder.cache_clear()
+    _ptr_type_by_name.cache_clear()
+    _FIELD_NAMES.clear()
+    _string_layout.cache_clear()
+    _qdatetime_private_layout.cache_clear()
+    QMapPrinter._stdMapLookups.clear()
+
+class Qt6PrettyPrinter(gdb.printing.PrettyPrinter):
+    """Collection of Qt6 printers, drop-in replacement for RegexpCollectionPrettyPrinter
+
+    Printers registered for an exact type name (regexp '^Name$') or for any
+    instantiation of a template (regexp '^Name<.*>$') are found with a single
+    dict lookup, only the remaining printers are matched by regexp.
+    """
+
+    EXACT_RE = re.compile(r'\^([\w:]+)\$')
+    TEMPLATE_RE = re.compile(r'\^([\w:]+)<\.\*>\$')
+
+    class SubPrinter(gdb.printing.SubPrettyPrinter):
+        def __init__(self, _name : str, _regexp : str, _gen_printer):
+            super().__init__(_name)
+            self.regexp = _regexp
+            self.gen_printer = _gen_printer
+            self.compiled_re = re.compile(_regexp)
+
+    def __init__(self, _name : str):
+        super().__init__(_name, [])
+        self.exact = {}
+        self.templates = {}
+        self.regexps = []
+
+    def add_printer(self, name, regexp, gen_printer):
+        printer = self.SubPrinter(name, regexp, gen_printer)
+        self.subprinters.append(printer)
+        match = self.EXACT_RE.fullmatch(regexp)
+        if match:
+            self.exact.setdefault(match.group(1), printer)
+            return
+        match = self.TEMPLATE_RE.fullmatch(regexp)
+        if match:
+            self.templates.setdefault(match.group(1), printer)
+            return
+        self.regexps.append(printer)
+
+    def __call__(self, val):
+        basicType = gdb.types.get_basic_type(val.type)
+        # every printer here is for a class, don't look up scalars, pointers, arrays, enums or unions
+        if basicType.code != gdb.TYPE_CODE_STRUCT:
+            return None
+        typename = basicType.tag
+        if not typename:
+            typename = val.type.name
+        if not typename:
+            return None
+
+        printer = self.exact.get(typename)
+        if printer is not None and printer.enabled:
+            return printer.gen_printer(val)
+
+        if typename.endswith('>'):
+            printer = self.templates.get(typename.split('<', 1)[0])
+            if printer is not None and printer.enabled:
+                return printer.gen_printer(val)
+
+        for printer in self.regexps:
+            if printer.enabled and printer.compiled_re.search(typename):
+                return printer.gen_printer(val)
+        return None
+
 def build_pretty_printer():
-    pp = gdb.printing.RegexpCollectionPrettyPrinter('Qt6Core')
-    pp.add_printer('QByteArray', '^QByteArray$', QByteArrayPrinter)
+    pp = Qt6PrettyPrinter('Qt6Core')
+    pp.add_printer('QByteArray', '^QByteArray$', QByteArrayChildrenPrinter if _BYTEARRAY_CHILDREN else QByteArrayPrinter)
     pp.add_printer('QChar', '^QChar$', QCharPrinter)
     pp.add_printer('QDate', '^QDate$', QDatePrinter)
     pp.add_printer('QDateTime', '^QDateTime$', QDateTimePrinter)
@@ -824,3 +982,4 @@ def build_pretty_printer():
     return pp
 
 printer = build_pretty_printer()
+gdb.events.clear_objfiles.connect(clear_caches)
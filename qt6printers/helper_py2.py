@@ -1,5 +0,0 @@
-class Iterator(object):
-    def next(self):
-        return type(self).__next__(self)
-
-unichr = unichr
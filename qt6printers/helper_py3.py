@@ -1,2 +0,0 @@
-Iterator = object
-unichr = chr